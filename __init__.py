@@ -1,11 +1,21 @@
 import bpy
 import itertools
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from bpy.app.handlers import persistent
 from bpy.types import (
     PropertyGroup, UIList, Operator, Panel
 )
 from bpy.props import (
     PointerProperty, CollectionProperty,
-    IntProperty, EnumProperty, FloatVectorProperty
+    IntProperty, BoolProperty, EnumProperty, FloatVectorProperty
 )
 
 class ColorItem(PropertyGroup):
@@ -21,12 +31,68 @@ class ColorItem(PropertyGroup):
     )
 
 
+# Blender requires the list returned by an EnumProperty items callback to be kept alive,
+# so the items are stored at module level and only rebuilt when the materials change
+_mat_items_cache = []
+_mat_items_sig = None  # (material count, last material name) the cache was built for, None when invalidated
+_msgbus_owner = object()
+
+def get_material_items(self, context):
+    global _mat_items_cache, _mat_items_sig
+    # msgbus is not notified of changes made through the Python API, so also compare a cheap signature
+    materials = bpy.data.materials
+    sig = (len(materials), materials[-1].name if materials else None)
+    if sig != _mat_items_sig:
+        _mat_items_cache = [(m.name, m.name, "") for m in materials]
+        _mat_items_sig = sig
+    return _mat_items_cache
+
+def _invalidate_mat_items(*args):
+    global _mat_items_sig
+    _mat_items_sig = None
+
+# Name of the RGB node used for each material, keyed by material name_full. Node names are cached instead of
+# node references, since a reference to a node deleted without a msgbus notification would dangle
+_rgb_node_cache = {}
+
+def get_rgb_node(mat):
+    "Returns the RGB node driven for the material (the cached one while it exists, else the first one found), or None if it has none"
+    nodes = mat.node_tree.nodes
+    node = nodes.get(_rgb_node_cache.get(mat.name_full, ""))
+    if node is None or node.type != 'RGB':
+        # cache is stale or empty, rescan the node tree
+        node = next((n for n in nodes if n.type=='RGB'), None)
+        if node is not None:
+            _rgb_node_cache[mat.name_full] = node.name
+    return node
+
+def _invalidate_rgb_nodes(*args):
+    _rgb_node_cache.clear()
+
+def _subscribe_mat_items():
+    for key in ((bpy.types.BlendData, "materials"), (bpy.types.Material, "name")):
+        bpy.msgbus.subscribe_rna(key=key, owner=_msgbus_owner, args=(), notify=_invalidate_mat_items)
+    # the RGB node cache is keyed by material name, so renames invalidate it too
+    for key in ((bpy.types.NodeTree, "nodes"), (bpy.types.Material, "name")):
+        bpy.msgbus.subscribe_rna(key=key, owner=_msgbus_owner, args=(), notify=_invalidate_rgb_nodes)
+
+# msgbus subscriptions are cleared when a file is loaded, so they are renewed here
+@persistent
+def _on_load_post(*args):
+    _invalidate_mat_items()
+    _invalidate_rgb_nodes()
+    _subscribe_mat_items()
+
+# undo/redo can rename or restore materials without any msgbus notification
+@persistent
+def _on_undo_redo(*args):
+    _invalidate_mat_items()
+
+
 class MaterialItem(PropertyGroup):
     mat_name: EnumProperty(
         name="Material",
-        items=lambda self,ctx: [
-            (m.name, m.name, "") for m in bpy.data.materials
-        ]
+        items=get_material_items
     )
     colors: CollectionProperty(type=ColorItem)
     color_index: IntProperty(default=0)
@@ -34,21 +100,35 @@ class MaterialItem(PropertyGroup):
 class MasterSettings(PropertyGroup):
     materials: CollectionProperty(type=MaterialItem)
     mat_index: IntProperty(default=0)
+    workers: IntProperty(
+        name="Parallel Workers",
+        description="Number of background Blender processes rendering the batch in parallel (1 renders in this instance)",
+        default=1,
+        min=1,
+        soft_max=os.cpu_count() or 1
+    )
+    skip_duplicates: BoolProperty(
+        name="Skip Duplicate Colors",
+        description="Skip combinations that would produce identical images (repeated colors of a material, or a material listed more than once)",
+        default=False
+    )
 
 
 # UILists for Materials & Colors
 
 class BATCH_COLORS_UL_material_list(UIList):
     """List of materials"""
+    split_factor = 0.7  # reduce width of the dropdown, the rest of the row is left free to click for selection
+
     def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
-        split = layout.split(factor=0.7) # reduce width to allow for selection
-        split.prop(item, "mat_name", text="")
+        layout.split(factor=self.split_factor).prop(item, "mat_name", text="")
 
 class BATCH_COLORS_UL_color_list(UIList):
     """List of colors for the selected material"""
+    split_factor = 0.5  # reduce width of the swatch, clicking a full-width swatch opens the color picker instead of selecting
+
     def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
-        split = layout.split(factor=0.5) # reduce width to allow for selection
-        split.prop(item, "color", text="")  
+        layout.split(factor=self.split_factor).prop(item, "color", text="")
 
 
 # Operators to Add/Remove items
@@ -96,7 +176,7 @@ class BATCH_COLORS_OT_remove_color(Operator):
     def poll(cls, context):
         settings = context.scene.batch_settings
         mat_item = settings.materials[settings.mat_index]
-        return mat_item.colors and len(mat_item.colors) > 1
+        return len(mat_item.colors) > 1
     
     def execute(self, context):
         settings = context.scene.batch_settings
@@ -107,65 +187,269 @@ class BATCH_COLORS_OT_remove_color(Operator):
 
 
 
+# Line printed by a worker after each rendered frame, read back for the progress bar (also used in _WORKER_SCRIPT)
+_WORKER_PROGRESS = "BATCH_COLOR_RENDERED"
+
+# Script run by each background Blender worker. It renders every n-th combination, so workers write disjoint files.
+# Arguments after "--": worker index, worker count, absolute base output path, JSON list of (material name, RGB node name, colors)
+_WORKER_SCRIPT = """
+import bpy, itertools, json, sys
+worker_id, n_workers, base_path, payload = sys.argv[sys.argv.index("--") + 1:]
+mat_colors = json.loads(payload)
+sockets = [bpy.data.materials[mat_name].node_tree.nodes[node_name].outputs[0] for mat_name, node_name, _ in mat_colors]
+render = bpy.context.scene.render
+path_template = base_path.replace("{", "{{").replace("}", "}}") + "_{:03d}.png"
+combos = enumerate(itertools.product(*(colors for _, _, colors in mat_colors)))
+pointers = [socket.as_pointer() for socket in sockets]
+last_colors = {}  # keyed by socket pointer, a material listed twice shares one socket (nothing else edits the scene here)
+for count, combo in itertools.islice(combos, int(worker_id), None, int(n_workers)):
+    for socket, pointer, color in zip(sockets, pointers, combo):
+        if last_colors.get(pointer) != color:
+            socket.default_value = color
+            last_colors[pointer] = color
+    render.filepath = path_template.format(count)
+    bpy.ops.render.render('EXEC_DEFAULT', write_still=True)
+    print("BATCH_COLOR_RENDERED", flush=True)
+"""
+
+
 # TODO: Add a verification step that computes the number of combinations and asks for confirmation before rendering
 class BATCH_COLORS_OT_render_batch(Operator):
     """Render all combinations (cartesian product) of material colors.""" 
     bl_idname = "batch.render_combinations"
     bl_description = "Render batch of all color combinations"
-    bl_options = {'REGISTER', 'UNDO'}
+    bl_options = {'REGISTER'}  # not undoable, the rendered files are already written to disk
     bl_label = "Start Batch Render"
     
     combination_count = 0
+    _cached = None  # result of _collect() computed in invoke, reused by execute
+    _workers = ()  # background Blender processes, when rendering in parallel
+    _tmp_dir = None
+    _timer = None
+    _running = False  # set on the class while a batch is in progress, so a second batch can't start on top of it
+
+    @classmethod
+    def poll(cls, context):
+        return not cls._running
 
-    def get_color_combinations(self, context):
-        "Outputs a touple of two lists: One list of color combinations, and one list of materials"
+    def _collect(self, context):
+        "Outputs a touple of two lists: The (material name, RGB node name) pairs to render, and their lists of RGBA color tuples"
         settings = context.scene.batch_settings
         
-        materials = []
+        targets = []
         color_lists = []
         
         # Only add material to render list if it has at least one RGB node
         for mat_item in settings.materials:
             mat = bpy.data.materials.get(mat_item.mat_name)
             if mat and mat.use_nodes:
-                nodes = [n for n in mat.node_tree.nodes if n.type=='RGB']
-                if not nodes:
+                rgb_node = get_rgb_node(mat)
+                if rgb_node is None:
                     self.report({'WARNING'}, f"No RGB node found in {mat.name}. Skipping material...")
                 else:
-                    color_lists.append(mat_item.colors[:])
-                    materials.append(mat)
+                    # plain RGBA tuples are cheaper to iterate inside the product than ColorItem wrappers
+                    colors = tuple(tuple(c.color) for c in mat_item.colors)
+                    if settings.skip_duplicates:
+                        # a color repeated within one material's list only repeats images
+                        colors = tuple(dict.fromkeys(colors))
+                    color_lists.append(colors)
+                    # keep the node name, so the render loop doesn't search the node tree again
+                    targets.append((mat.name, rgb_node.name))
             else:
                 self.report({'WARNING'}, f"Error while reading material {mat_item.mat_name}! Skipping...")
 
-        # Cartesian product of color lists
-        combos = list(itertools.product(*[color_list for color_list in color_lists]))
-        return combos, materials
+        if settings.skip_duplicates:
+            # rows of the same material drive the same socket, where the last row always wins,
+            # so the colors of the earlier rows only repeat images
+            last_rows = sorted({mat_name: i for i, (mat_name, _) in enumerate(targets)}.values())
+            targets = [targets[i] for i in last_rows]
+            color_lists = [color_lists[i] for i in last_rows]
 
-    def execute(self, context):
-        count = 0
-        color_combinations, materials = self.get_color_combinations(context = context)
+        return targets, color_lists
 
-        for combo in color_combinations:
-            for mat, color_item in zip(materials, combo):
-                # get first RGB node in the material
-                rgb_node = next(node for node in mat.node_tree.nodes if node.type=='RGB')
-                # set the color of the RGB node
-                rgb_node.outputs[0].default_value = color_item.color
-                
-            # build filepath suffix
-            base_path = bpy.context.scene.render.filepath
-            suffix = f"_{count:03d}"
-            
-            bpy.context.scene.render.filepath = f"{base_path}{suffix}.png"
-            bpy.ops.render.render(write_still=True)
-            bpy.context.scene.render.filepath = base_path  # reset filepath
-            count += 1
+    def get_color_combinations(self, color_lists):
+        "Outputs a touple of: A lazy iterator over color combinations, and the total number of combinations"
+        # Cartesian product of color lists, not materialized (can grow very quickly)
+        product_iter = itertools.product(*color_lists)
+        total_count = math.prod(map(len, color_lists))
+        return product_iter, total_count
 
+    def execute(self, context):
+        self._targets, color_lists = self._cached or self._collect(context = context)
+        self._cached = None
+        product_iter, self._total_count = self.get_color_combinations(color_lists)
+        self._combos = enumerate(product_iter)
+
+        self._render = context.scene.render
+        self._base_path = self._render.filepath
+        # braces are legal in file paths, so they are escaped before using the path as a format template
+        self._path_template = self._base_path.replace("{", "{{").replace("}", "}}") + "_{:03d}.png"
+
+        # starting more workers than combinations would only load the scene in processes with nothing to render
+        workers = min(context.scene.batch_settings.workers, self._total_count)
+        if workers > 1:
+            try:
+                self._start_workers(color_lists, workers)
+            except Exception as err:
+                self.report({'ERROR'}, f"Batch render failed to start workers: {err}")
+                return {'CANCELLED'}
+
+        wm = context.window_manager
+        wm.progress_begin(0, self._total_count)
+        BATCH_COLORS_OT_render_batch._running = True
+
+        # scripted or background runs have no window or event loop to drive a modal operator, so render in a plain loop
+        if bpy.app.background or context.window is None:
+            while (status := self._tick(context)) == {'RUNNING_MODAL'}:
+                if self._workers:
+                    time.sleep(0.1)
+            return status
+
+        # Render one combination per timer tick (or poll the workers), so the UI stays responsive and the batch can be cancelled
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self.cancel(context)
+            self.report({'WARNING'}, "Batch render cancelled")
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        return self._tick(context)
+
+    def _tick(self, context):
+        "Renders the next combination (or polls the workers). Any error ends the batch, so the scene state is always restored"
+        try:
+            if self._workers:
+                return self._poll_workers(context)
+            return self._render_next(context)
+        except Exception as err:
+            self._finish(context)
+            self.report({'ERROR'}, f"Batch render failed: {err}")
+            return {'CANCELLED'}
+
+    def _get_socket(self, target):
+        "Looks up the RGB node output socket of a (material name, node name) target"
+        # looked up by name on every write instead of cached, since materials and nodes can be deleted while the batch runs
+        mat_name, node_name = target
+        mat = bpy.data.materials.get(mat_name)
+        node = mat.node_tree.nodes.get(node_name) if mat and mat.node_tree else None
+        if node is None:
+            raise RuntimeError(f"RGB node of material {mat_name} was removed")
+        return node.outputs[0]
+
+    def _render_next(self, context):
+        next_combo = next(self._combos, None)
+        if next_combo is None:
+            self._finish(context)
+            self.report({'INFO'}, f"Batch render finished ({self._total_count} images)")
+            return {'FINISHED'}
+
+        count, combo = next_combo
+        # the product changes few materials between consecutive combinations, and every socket write tags a depsgraph update.
+        # The socket's current value is compared rather than the last written one, since the UI stays live between
+        # renders and the user can edit the node or undo
+        for target, color in zip(self._targets, combo):
+            socket = self._get_socket(target)
+            if tuple(socket.default_value) != color:
+                # set the color of the RGB node
+                socket.default_value = color
+
+        context.window_manager.progress_update(count)
+        self._render.filepath = self._path_template.format(count)
+        bpy.ops.render.render('EXEC_DEFAULT', write_still=True)
+        return {'RUNNING_MODAL'}
+
+    def _start_workers(self, color_lists, n_workers):
+        "Saves a copy of the scene and launches background Blender processes that each render every n-th combination"
+        self._tmp_dir = tempfile.mkdtemp(prefix="batch_color_")
+        self._workers = []
+        self._rendered = [0] * n_workers  # frames rendered per worker, each entry only written by its reader thread
+        try:
+            tmp_blend = os.path.join(self._tmp_dir, "batch.blend")
+            bpy.ops.wm.save_as_mainfile(filepath=tmp_blend, copy=True)
+
+            # relative output paths would resolve against the temporary file
+            base_path = bpy.path.abspath(self._base_path)
+            # pass the RGB nodes resolved here, so workers drive the same nodes as an in-process batch
+            payload = json.dumps([
+                (mat_name, node_name, colors) for (mat_name, node_name), colors in zip(self._targets, color_lists)
+            ])
+            # split the cores between workers, instead of every worker starting a render thread per core
+            threads = str(max(1, (os.cpu_count() or 1) // n_workers))
+            for worker_id in range(n_workers):
+                worker = subprocess.Popen([
+                    bpy.app.binary_path, "-b", "--factory-startup", "-t", threads, tmp_blend,
+                    "--python-exit-code", "1", "--python-expr", _WORKER_SCRIPT,
+                    "--", str(worker_id), str(n_workers), base_path, payload
+                ], stdout=subprocess.PIPE, text=True, errors="replace")
+                self._workers.append(worker)
+                threading.Thread(target=self._read_worker_output, args=(worker_id, worker), daemon=True).start()
+        except Exception:
+            # don't leak the workers already started or the temporary file
+            self._stop_workers()
+            raise
+
+    def _read_worker_output(self, worker_id, worker):
+        "Drains the output of a worker, counting its rendered frames and passing everything else through to the console"
+        # the pipe has to be drained anyway, or a worker blocks once the pipe buffer fills up
+        for line in worker.stdout:
+            if line.startswith(_WORKER_PROGRESS):
+                self._rendered[worker_id] += 1
+            else:
+                sys.stdout.write(line)
+
+    def _poll_workers(self, context):
+        if any(worker.poll() is None for worker in self._workers):
+            context.window_manager.progress_update(sum(self._rendered))
+            return {'RUNNING_MODAL'}
+
+        failed = sum(worker.returncode != 0 for worker in self._workers)
+        worker_count = len(self._workers)
+        self._finish(context)
+        if failed:
+            self.report({'ERROR'}, f"Batch render failed in {failed} of {worker_count} workers")
+            return {'CANCELLED'}
+        self.report({'INFO'}, f"Batch render finished ({self._total_count} images)")
         return {'FINISHED'}
+
+    def cancel(self, context):
+        self._finish(context)
+
+    def _finish(self, context):
+        "Removes the timer, stops remaining workers and restores the scene state changed by the batch"
+        if not BATCH_COLORS_OT_render_batch._running:
+            return
+        BATCH_COLORS_OT_render_batch._running = False
+
+        wm = context.window_manager
+        if self._timer:
+            wm.event_timer_remove(self._timer)
+            self._timer = None
+        wm.progress_end()
+        self._render.filepath = self._base_path  # reset filepath
+        self._stop_workers()
+
+    def _stop_workers(self):
+        "Terminates workers that are still running and removes the temporary scene file"
+        for worker in self._workers:
+            if worker.poll() is None:
+                worker.terminate()
+                worker.wait()
+        self._workers = ()
+        if self._tmp_dir:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
     
     # Add confirmation dialog before rendering (because total number of combinations can grow very quickly)
     def invoke(self, context, event):
-        return context.window_manager.invoke_confirm(self, event, message = f"Render batch totalling {len(self.get_color_combinations(context=context)[0])} images (material color combinations)?")
+        self._cached = self._collect(context = context)
+        self.combination_count = self.get_color_combinations(self._cached[1])[1]
+        return context.window_manager.invoke_confirm(self, event, message = f"Render batch totalling {self.combination_count} images (material color combinations)?")
 
 
 class BATCH_COLORS_PT_batch_render_settings(Panel):
@@ -202,6 +486,8 @@ class BATCH_COLORS_PT_batch_render_settings(Panel):
             sub2.operator("color_list.remove_color", icon='REMOVE', text="")
 
         self.layout.separator()
+        self.layout.prop(settings, "workers")
+        self.layout.prop(settings, "skip_duplicates")
         self.layout.operator("batch.render_combinations", icon='RENDER_STILL')
 
 classes = (
@@ -212,15 +498,23 @@ classes = (
     BATCH_COLORS_OT_render_batch, BATCH_COLORS_PT_batch_render_settings
 )
 
+_register_classes, _unregister_classes = bpy.utils.register_classes_factory(classes)
+
 def register():
-    for cls in classes:
-        bpy.utils.register_class(cls)
+    _register_classes()
     bpy.types.Scene.batch_settings = PointerProperty(type=MasterSettings)
+    _subscribe_mat_items()
+    bpy.app.handlers.load_post.append(_on_load_post)
+    bpy.app.handlers.undo_post.append(_on_undo_redo)
+    bpy.app.handlers.redo_post.append(_on_undo_redo)
 
 def unregister():
+    bpy.app.handlers.redo_post.remove(_on_undo_redo)
+    bpy.app.handlers.undo_post.remove(_on_undo_redo)
+    bpy.app.handlers.load_post.remove(_on_load_post)
+    bpy.msgbus.clear_by_owner(_msgbus_owner)
     del bpy.types.Scene.batch_settings
-    for cls in reversed(classes):
-        bpy.utils.unregister_class(cls)
+    _unregister_classes()
 
 if __name__ == "__main__":
     register()